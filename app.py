@@ -1,21 +1,23 @@
 from hashlib import new
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File as FastAPIFile
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File as FastAPIFile, Header, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import object_session
 from sqlalchemy.util import decode_backslashreplace
 from starlette.concurrency import run_in_threadpool
 from starlette.responses import RedirectResponse
-from typing import Callable
+from typing import Callable, Optional
 from enum import Enum
 
-from database import Vault, File, get_session
+from database import Vault, File, FileTombstone, get_session, get_read_session, bump_vault_version
 from s3 import s3_client, bucket_exists, S3_BUCKET_NAME
 from config import FRONTEND_HOST
 from sqlalchemy import select, delete, and_
 from auth import Password, Token
+from etag import etag_matches
+from vault_sync import guest_changes
 from models.request import VaultCreateCredentials, VaultLoginCredentials, FileUpdateModel, VaultUpdateModel, BulkDeleteRequest
-from models.response import SuccessModel, ErrorModel, LoginSuccessModel, DownloadModel, VaultModel, BulkDeleteResponse 
+from models.response import SuccessModel, ErrorModel, LoginSuccessModel, DownloadModel, VaultModel, VaultChangesModel, BulkDeleteResponse 
 from uuid import UUID
 
 class Role(str, Enum):
@@ -38,6 +40,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 bearer_scheme = HTTPBearer()
@@ -50,6 +53,13 @@ def get_token_payload(credentials: HTTPAuthorizationCredentials = Depends(bearer
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid or Expired Token")
 
+def get_session_for_role(token_payload: dict = Depends(get_token_payload)):
+    # owners must see their own uploads, renames and deletes, so only guests read from the replica
+    if token_payload.get("role") == Role.OWNER:
+        yield from get_session()
+    else:
+        yield from get_read_session()
+
 if bucket_exists():
     pass
 else:
@@ -100,10 +110,18 @@ You must include this token in the `Authorization` header (`Bearer <token>`) to
 )
 def login_to_vault(
         vault_credentials: VaultLoginCredentials,
-        db_session = Depends(get_session)
+        db_session = Depends(get_read_session),
+        primary_session = Depends(get_session)
 ):
     stmt = select(Vault).where(Vault.vault == vault_credentials.vault)
-    vault = db_session.scalars(stmt).first()
+    if vault_credentials.password is not None:
+        # password checks must see the latest password and name, so owner logins stay on the primary
+        vault = primary_session.scalars(stmt).first()
+    else:
+        vault = db_session.scalars(stmt).first()
+        if vault is None:
+            # the replica may not have caught up with a freshly created or renamed vault yet
+            vault = primary_session.scalars(stmt).first()
 
     if vault is None:
         raise HTTPException(status_code=404, detail="Vault Not Found")
@@ -121,29 +139,96 @@ def login_to_vault(
 @app.get("/vault/fetch",
     tags=["Vault Operations"],
     response_model=VaultModel,
+    description="""
+Returns the vault information and its file list.
+
+The response carries an `ETag` header that changes whenever a file is uploaded, updated or deleted, or the vault is renamed.  
+Send it back in the `If-None-Match` header to get an empty **304 Not Modified** response while nothing has changed.
+""",
     responses={
+        304: {"description": "Vault has not changed since the given ETag"},
         401: {"model": ErrorModel},
         403: {"model": ErrorModel},
         404: {"model": ErrorModel}
     }
 )
 def fetch_file_list_from_vault(
+        response: Response,
         token_payload: dict = Depends(get_token_payload),
-        db_session = Depends(get_session)
+        if_none_match: Optional[str] = Header(None),
+        db_session = Depends(get_session_for_role)
 ):
     vault_id= token_payload.get("vault_id")
     role = token_payload.get("role")
     vault = db_session.scalars(select(Vault).where(Vault.id==vault_id)).first()
     if vault is None:
         raise HTTPException(status_code=404, detail="Vault Not Found")
+    # guests see a different file list, so the role is part of the tag
+    etag = f'W/"{vault.id}-{role}-{vault.version}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
     files_stmt = select(File)
     if role == Role.GUEST:
         files_stmt = files_stmt.where(and_(File.vault_id== vault_id, File.visibility == "public"))
     elif role == Role.OWNER:
         files_stmt = files_stmt.where(File.vault_id == vault_id) # All Files, without any filter
     files = db_session.scalars(files_stmt).all()
+    response.headers.update(headers)
     return {"vault": vault, "files": files}
 
+@app.get("/vault/changes",
+    tags=["Vault Operations"],
+    response_model=VaultChangesModel,
+    description="""
+Returns only the files that were added, changed or deleted since the given `cursor`.
+
+- Start with `cursor=0` to get every file, then pass the returned `cursor` on the next call.  
+- `files` holds added or changed files, `deleted` holds the ids of files that were removed.  
+- For guests, public files that were made private are reported as deleted.  
+- A **410 Gone** means the cursor is older than the retained history, start over with `cursor=0`.
+""",
+    responses={
+        401: {"model": ErrorModel},
+        403: {"model": ErrorModel},
+        404: {"model": ErrorModel},
+        410: {"model": ErrorModel}
+    }
+)
+def fetch_vault_changes(
+        cursor: int = Query(0, ge=0, description="Cursor returned by the previous sync, 0 for a full sync"),
+        token_payload: dict = Depends(get_token_payload),
+        db_session = Depends(get_session_for_role)
+):
+    vault_id= token_payload.get("vault_id")
+    role = token_payload.get("role")
+    # read the version first, anything committed after this shows up in the next sync
+    vault = db_session.execute(select(Vault.version, Vault.min_cursor).where(Vault.id==vault_id)).first()
+    if vault is None:
+        raise HTTPException(status_code=404, detail="Vault Not Found")
+    if 0 < cursor < vault.min_cursor:
+        raise HTTPException(status_code=410, detail="Cursor expired, resync with cursor=0")
+
+    files_stmt = select(File).where(File.vault_id == vault_id)
+    if cursor > 0:
+        files_stmt = files_stmt.where(File.version > cursor)
+    changed_files = db_session.scalars(files_stmt).all()
+
+    deleted = []
+    if cursor > 0:
+        tombstones_stmt = select(FileTombstone.file_id).where(and_(FileTombstone.vault_id == vault_id, FileTombstone.version > cursor))
+        if role == Role.GUEST:
+            # guests only hear about files they could have seen since their cursor
+            tombstones_stmt = tombstones_stmt.where(FileTombstone.public_until > cursor)
+        deleted = list(db_session.scalars(tombstones_stmt).all())
+
+    if role == Role.GUEST:
+        files, hidden = guest_changes(changed_files, cursor)
+        deleted += hidden
+    else:
+        files = changed_files
+    return {"cursor": vault.version, "files": files, "deleted": deleted}
+
 @app.put("/vault",
     tags=["Vault Operations"],
     response_model=SuccessModel,
@@ -179,6 +264,7 @@ def update_vault(
         vault.vault = update_data.new_name
     if update_data.new_password:
         vault.password_hash = Password.generate_hash(update_data.new_password)
+    bump_vault_version(db_session, vault_id)
     db_session.commit()
     return {"message": "Vault Information Updated successfully"}
 
@@ -251,6 +337,7 @@ async def upload_file(
         new_file = File(vault_id = vault_id, file = file_name, size=file_size)
         db_session.add(new_file)
         vault.used_storage += file_size
+        new_file.version = bump_vault_version(db_session, vault_id)
         db_session.commit()
 
         # Run the upload_fileobj via the threadpool and await it
@@ -280,7 +367,7 @@ async def upload_file(
 async def download_file(
         file_id: UUID,
         token_payload: dict = Depends(get_token_payload),
-        db_session = Depends(get_session)
+        db_session = Depends(get_session_for_role)
 ):
     vault_id = token_payload.get("vault_id")
     role = token_payload.get("role")
@@ -333,10 +420,11 @@ async def update_file(
     stmt = select(File).where(and_(File.vault_id == vault_id, File.id == file_id))
     file = db_session.scalars(stmt).first()
     if file:
+        file.version = bump_vault_version(db_session, vault_id)
         if update_data.new_name is not None:
             file.file = update_data.new_name
         if update_data.visibility is not None:
-            file.visibility = update_data.visibility
+            file.set_visibility(update_data.visibility, file.version)
         db_session.commit()
         return {"message": "File updated successfully"}
     else:
@@ -365,8 +453,11 @@ async def delete_file(
         db_session.delete(file)
         find_vault_stmt = select(Vault).where(Vault.id == vault_id)
         vault = db_session.scalars(find_vault_stmt).first()
-        vault.used_storage-=file.size
         s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=str(file_id))
+        vault.used_storage-=file.size
+        # bump last, it locks the vault row until commit
+        version = bump_vault_version(db_session, vault_id)
+        db_session.add(FileTombstone.for_file(file.id, vault_id, file.visibility, file.hidden_version, version))
         db_session.commit()
         return {"message":"file deleted successfully"}
     else:
@@ -389,20 +480,22 @@ async def bulk_delete(
         db_session = Depends(get_session)
 ):
     vault_id = token_payload.get("vault_id")
-    stmt = select(File).where(File.id.in_(file_ids.file_ids))
+    stmt = select(File).where(and_(File.vault_id == vault_id, File.id.in_(file_ids.file_ids)))
     files_to_delete = db_session.scalars(stmt).all()
     if len(files_to_delete) == 0:
         raise HTTPException(status_code=404, detail="No files found")
     file_ids_to_delete = []
+    deleted_visibility = []
     freed_space = 0
     for file in files_to_delete:
         file_ids_to_delete.append(file.id)
+        deleted_visibility.append((file.id, file.visibility, file.hidden_version))
         freed_space += file.size
     files_not_found = list(set(file_ids.file_ids) - set(file_ids_to_delete))
 
     try:
         # delete from database 
-        delete_stmt = delete(File).where(File.id.in_(file_ids_to_delete))
+        delete_stmt = delete(File).where(and_(File.vault_id == vault_id, File.id.in_(file_ids_to_delete)))
         db_session.execute(delete_stmt)
         
         # Delete from s3 
@@ -413,6 +506,13 @@ async def bulk_delete(
         vault_stmt = select(Vault).where(Vault.id==vault_id)
         vault = db_session.scalars(vault_stmt).first()
         vault.used_storage = vault.used_storage - freed_space
+
+        # leave tombstones for incremental syncs, bumped last since it locks the vault row until commit
+        version = bump_vault_version(db_session, vault_id)
+        db_session.add_all([
+            FileTombstone.for_file(file_id, vault_id, visibility, hidden_version, version)
+            for file_id, visibility, hidden_version in deleted_visibility
+        ])
         db_session.commit()
         return {"deleted_files":{"count":len(file_ids_to_delete), "file_ids":file_ids_to_delete}, "files_not_found": {"count": len(files_not_found), "file_ids": files_not_found}}
     except Exception as e:
@@ -432,7 +532,7 @@ async def bulk_delete(
 async def get_file_from_url(
     vault_name: str,
     file_id: UUID,
-    db_session = Depends(get_session),
+    db_session = Depends(get_read_session),
 ):
     stmt = select(Vault).where(Vault.vault == vault_name)
     vault_id = db_session.scalars(stmt).first().id
@@ -1 +1 @@
-from .db import Vault, File, get_session
+from .db import Vault, File, FileTombstone, get_session, get_read_session, bump_vault_version, purge_tombstones
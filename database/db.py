@@ -1,17 +1,30 @@
+import logging
+import threading
+import time
 from datetime import  datetime, timezone 
-from sqlalchemy import BigInteger, DateTime, ForeignKey
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Index
 from sqlalchemy import String
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, select, update, delete, func, Insert, Update, Delete
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
 
 import uuid
 import uuid6
+from typing import Optional
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
-from config import DATABASE_URL
+import vault_sync
+from config import (
+    DATABASE_URL, DATABASE_REPLICA_URL,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW,
+    DB_POOL_WAIT_WARN_MS,
+)
+
+logger = logging.getLogger(__name__)
 
 MB = 1024 * 1024
 GB = MB * 1024
@@ -27,9 +40,11 @@ class Vault(Base):
     password_hash: Mapped[str] = mapped_column(String(60))
     size: Mapped[int] = mapped_column(BigInteger, default=500*MB) # Size in bytes, default is 500 MB
     used_storage: Mapped[int] = mapped_column(default=0)
+    version: Mapped[int] = mapped_column(BigInteger, default=0) # bumped on every change to the vault or its files
+    min_cursor: Mapped[int] = mapped_column(BigInteger, default=0) # oldest change cursor still served, older tombstones are purged
 
     def __repr__(self) -> str:
-        return f"Vault(id={self.id!r}, vault={self.vault!r}, date_created={self.date_created!r},size={self.size!r}, used_storage={self.used_storage!r}, password_hash={self.password_hash!r})"
+        return f"Vault(id={self.id!r}, vault={self.vault!r}, date_created={self.date_created!r},size={self.size!r}, used_storage={self.used_storage!r}, version={self.version!r}, min_cursor={self.min_cursor!r}, password_hash={self.password_hash!r})"
 
 class File(Base):
     __tablename__ = "files"
@@ -47,23 +62,155 @@ class File(Base):
     file: Mapped[str] 
     size: Mapped[int] = mapped_column(BigInteger)# Size in bytes
     date_created: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    version: Mapped[int] = mapped_column(BigInteger, default=0) # vault version of the last change to this file
+    hidden_version: Mapped[Optional[int]] = mapped_column(BigInteger, default=None) # vault version at which a public file was made private
 
+    __table_args__ = (Index("ix_files_vault_id_version", "vault_id", "version"),)
+
+    def set_visibility(self, visibility: str, version: int) -> None:
+        vault_sync.apply_visibility(self, visibility, version)
 
     def __repr__(self) -> str:
-        return f"file(id={self.id!r}, visibility={self.visibility!r},vault={self.vault_id!r},  file={self.file!r}, size={self.size!r}, date_created={self.date_created!r})"
+        return f"file(id={self.id!r}, visibility={self.visibility!r},vault={self.vault_id!r},  file={self.file!r}, size={self.size!r}, date_created={self.date_created!r}, version={self.version!r}, hidden_version={self.hidden_version!r})"
+
+class FileTombstone(Base):
+    # left behind by deleted files so incremental syncs can report the deletion
+    __tablename__ = "file_tombstones"
+    file_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
+    vault_id: Mapped[int] = mapped_column(
+        ForeignKey("vaults.id", ondelete="CASCADE"),
+        nullable=False
+    )
+    version: Mapped[int] = mapped_column(BigInteger) # vault version the file was deleted at
+    public_until: Mapped[Optional[int]] = mapped_column(BigInteger, default=None) # last vault version guests could see the file, None if never public
+    date_deleted: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (Index("ix_file_tombstones_vault_id_version", "vault_id", "version"),)
+
+    def __repr__(self) -> str:
+        return f"FileTombstone(file_id={self.file_id!r}, vault={self.vault_id!r}, version={self.version!r}, public_until={self.public_until!r}, date_deleted={self.date_deleted!r})"
+
+    @staticmethod
+    def for_file(file_id: uuid.UUID, vault_id: int, visibility: str, hidden_version: Optional[int], version: int) -> "FileTombstone":
+        return FileTombstone(
+            file_id=file_id, vault_id=vault_id, version=version,
+            public_until=vault_sync.public_until(visibility, hidden_version, version)
+        )
+
+
+def bump_vault_version(session: Session, vault_id: int) -> int:
+    """Increments the vault's version in the current transaction and returns the new value."""
+    stmt = (
+        update(Vault)
+        .where(Vault.id == vault_id)
+        .values(version=Vault.version + 1)
+        .returning(Vault.version)
+        .execution_options(synchronize_session="fetch")
+    )
+    return session.execute(stmt).scalar_one()
+
+
+def purge_tombstones(session: Session, older_than: datetime) -> int:
+    """
+    Deletes tombstones older than the cutoff and raises each affected vault's min_cursor past them,
+    so clients with an older cursor are told to do a full sync. Returns the number of tombstones removed.
+    """
+    purged = (
+        select(FileTombstone.vault_id, func.max(FileTombstone.version).label("version"))
+        .where(FileTombstone.date_deleted < older_than)
+        .group_by(FileTombstone.vault_id)
+        .subquery()
+    )
+    session.execute(
+        update(Vault)
+        .where(Vault.id == purged.c.vault_id)
+        .values(min_cursor=func.greatest(Vault.min_cursor, purged.c.version))
+        .execution_options(synchronize_session=False)
+    )
+    result = session.execute(
+        delete(FileTombstone)
+        .where(FileTombstone.date_deleted < older_than)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+_checkout_state = threading.local()
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that reports how long each checkout took. The time covers waiting in the queue,
+    the pre-ping and, when the pool has to grow, opening the new connection, which is flagged in the log.
+    """
+
+    def connect(self):
+        _checkout_state.opened = False
+        started = time.perf_counter()
+        connection = super().connect()
+        took_ms = (time.perf_counter() - started) * 1000
+        name = self.logging_name or "pool"
+        opened = " incl. opening a new connection" if _checkout_state.opened else ""
+        if took_ms >= DB_POOL_WAIT_WARN_MS:
+            logger.warning("%s checkout took %.1f ms%s (%s)", name, took_ms, opened, self.status())
+        else:
+            logger.debug("%s checkout took %.1f ms%s", name, took_ms, opened)
+        return connection
+
+@event.listens_for(TimedQueuePool, "connect")
+def _mark_new_connection(dbapi_connection, connection_record):
+    _checkout_state.opened = True
 
 
 engine = create_engine(
     DATABASE_URL, echo=True,
+    poolclass=TimedQueuePool,
+    pool_logging_name="primary",
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
     pool_pre_ping=True, # check if connection is dead before pooling 
     pool_recycle=300
 )
 Base.metadata.create_all(engine) # Creates all tables defined by models in Base.metadata, if they don't exist already
 
+if DATABASE_REPLICA_URL:
+    replica_engine = create_engine(
+        DATABASE_REPLICA_URL, echo=True,
+        poolclass=TimedQueuePool,
+        pool_logging_name="replica",
+        pool_size=DB_REPLICA_POOL_SIZE,
+        max_overflow=DB_REPLICA_MAX_OVERFLOW,
+        pool_pre_ping=True,
+        pool_recycle=300
+    )
+else:
+    replica_engine = engine # no replica configured, reads go to the primary
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads to the replica when opened as read_only.
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+    """
+
+    def __init__(self, read_only: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self.read_only = read_only
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            return engine
+        if self.read_only:
+            return replica_engine
+        return engine
 
 
 def get_session():
-    with Session(engine) as session:
+    with RoutingSession() as session:
         yield session  # session automatically closes when done
 
+def get_read_session():
+    # for read-only endpoints, may lag behind the primary when a replica is configured
+    with RoutingSession(read_only=True) as session:
+        yield session
+
 
@@ -0,0 +1,14 @@
+from typing import Optional
+
+
+def strip_weak(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Checks an If-None-Match header against an ETag using weak comparison (RFC 9110)."""
+    if if_none_match is None:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    return strip_weak(etag) in [strip_weak(tag) for tag in candidates]
@@ -29,6 +29,11 @@ class VaultModel(BaseModel):  # renamed to match PascalCase convention
     vault: VaultInfoModel
     files: List[FileInfo]
 
+class VaultChangesModel(BaseModel):
+    cursor: int
+    files: List[FileInfo]
+    deleted: List[UUID]
+
 class SuccessModel(BaseModel):
     message: str
 
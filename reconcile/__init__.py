@@ -0,0 +1,2 @@
+# scanner is not imported here, importing it connects to the database
+from .merge import merge_join, is_file_key
@@ -0,0 +1,29 @@
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.orm import Session
+
+from config import TOMBSTONE_RETENTION_DAYS
+from database.db import engine, purge_tombstones
+from .scanner import reconcile
+
+parser = argparse.ArgumentParser(
+    prog="python -m reconcile",
+    description="Find and optionally repair drift between the files table, the S3 bucket and vault quotas."
+)
+parser.add_argument("--repair", action="store_true", help="fix mismatches instead of only reporting them")
+parser.add_argument("--page-size", type=int, default=1000, help="objects and rows fetched per page (default: 1000)")
+parser.add_argument("--grace-seconds", type=int, default=3600, help="skip repairing anything newer than this (default: 3600)")
+parser.add_argument("--purge-tombstones", action="store_true", help=f"delete tombstones older than TOMBSTONE_RETENTION_DAYS ({TOMBSTONE_RETENTION_DAYS}) and skip the scan")
+args = parser.parse_args()
+
+engine.echo = False # statement logging would drown out the report
+if args.purge_tombstones:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    with Session(engine) as session:
+        purged = purge_tombstones(session, older_than=cutoff)
+        session.commit()
+    print(f"purged_tombstones={purged}")
+else:
+    counts = reconcile(repair=args.repair, page_size=args.page_size, grace_seconds=args.grace_seconds)
+    print(", ".join(f"{name}={count}" for name, count in counts.items()))
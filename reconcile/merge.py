@@ -0,0 +1,31 @@
+from typing import Iterator, Optional, Tuple
+from uuid import UUID
+
+
+def merge_join(objects: Iterator[dict], rows: Iterator) -> Iterator[Tuple[Optional[dict], Optional[object]]]:
+    """
+    Walks both sorted streams together, yielding (object, row) pairs where either side may be None.
+    Postgres orders UUIDs bytewise, which matches the order of their lowercase string form used as S3 keys.
+    """
+    obj = next(objects, None)
+    row = next(rows, None)
+    while obj is not None or row is not None:
+        if row is None or (obj is not None and obj["Key"] < str(row.id)):
+            yield obj, None
+            obj = next(objects, None)
+        elif obj is None or str(row.id) < obj["Key"]:
+            yield None, row
+            row = next(rows, None)
+        else:
+            yield obj, row
+            obj = next(objects, None)
+            row = next(rows, None)
+
+
+def is_file_key(key: str) -> bool:
+    try:
+        return str(UUID(key)) == key
+    except ValueError:
+        return False
+
+
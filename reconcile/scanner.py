@@ -0,0 +1,186 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional
+from uuid import UUID
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.orm import Session
+
+from database.db import Vault, File, FileTombstone, engine, bump_vault_version
+from s3 import s3_client, S3_BUCKET_NAME
+from .merge import merge_join, is_file_key
+
+MISSING_OBJECT = "missing_object"   # files row with no S3 object behind it
+ORPHANED_OBJECT = "orphaned_object" # S3 object with no files row
+FOREIGN_OBJECT = "foreign_object"   # S3 key that isn't a file id, never deleted
+SIZE_MISMATCH = "size_mismatch"     # both exist but the sizes differ
+
+S3_DELETE_LIMIT = 1000 # delete_objects accepts at most 1000 keys per call
+
+
+def iter_s3_objects(page_size: int) -> Iterator[dict]:
+    """Yields every object in the bucket in key order, one page in memory at a time."""
+    paginator = s3_client.get_paginator("list_objects_v2")
+    pages = paginator.paginate(Bucket=S3_BUCKET_NAME, PaginationConfig={"PageSize": page_size})
+    for page in pages:
+        for obj in page.get("Contents", []):
+            yield obj
+
+
+def iter_file_rows(page_size: int) -> Iterator:
+    """Yields (id, vault_id, size, date_created) for every file in id order using keyset pagination."""
+    last_id = None
+    while True:
+        stmt = select(File.id, File.vault_id, File.size, File.date_created).order_by(File.id).limit(page_size)
+        if last_id is not None:
+            stmt = stmt.where(File.id > last_id)
+        # short lived session per page, so no transaction stays open for the whole scan
+        with Session(engine) as session:
+            rows = session.execute(stmt).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+
+def delete_orphaned_objects(keys: List[str]) -> int:
+    """Deletes the given keys, printing any per-key failures. Returns the number actually deleted."""
+    if not keys:
+        return 0
+    response = s3_client.delete_objects(Bucket=S3_BUCKET_NAME, Delete={"Objects": [{"Key": key} for key in keys]})
+    for error in response.get("Errors", []):
+        print(f"delete failed key={error.get('Key')!r} code={error.get('Code')} message={error.get('Message')!r}")
+    return len(response.get("Deleted", []))
+
+
+def delete_missing_rows(file_ids: List[UUID], cutoff: datetime) -> int:
+    """Deletes rows whose object is gone, leaving tombstones so clients drop them on their next sync."""
+    if not file_ids:
+        return 0
+    with Session(engine) as session:
+        # re-check the grace period, the row may have been replaced or deleted since it was scanned
+        stmt = (
+            delete(File)
+            .where(File.id.in_(file_ids), File.date_created < cutoff)
+            .returning(File.id, File.vault_id, File.visibility, File.hidden_version)
+            .execution_options(synchronize_session=False)
+        )
+        deleted: Dict[int, List] = defaultdict(list)
+        for row in session.execute(stmt):
+            deleted[row.vault_id].append(row)
+        for vault_id, rows in deleted.items():
+            version = bump_vault_version(session, vault_id)
+            session.add_all([
+                FileTombstone.for_file(row.id, vault_id, row.visibility, row.hidden_version, version)
+                for row in rows
+            ])
+        session.commit()
+    return sum(len(ids) for ids in deleted.values())
+
+
+def fix_file_size(file_id: UUID, vault_id: int, size: int) -> bool:
+    """Sets the row's size to the object's. Returns False if the row was deleted since it was scanned."""
+    with Session(engine) as session:
+        stmt = update(File).where(File.id == file_id).values(size=size).execution_options(synchronize_session=False)
+        updated = session.execute(stmt).rowcount > 0
+        if updated:
+            version = bump_vault_version(session, vault_id)
+            session.execute(update(File).where(File.id == file_id).values(version=version).execution_options(synchronize_session=False))
+        session.commit()
+    return updated
+
+
+def repair_used_storage(vault_id: int) -> Optional[int]:
+    """
+    Recomputes one vault's used_storage with the vault row locked, so uploads and deletes
+    committing meanwhile are either waited for or counted. Returns the new value, None if it was already right.
+    """
+    with Session(engine) as session:
+        used_storage = session.scalars(select(Vault.used_storage).where(Vault.id == vault_id).with_for_update()).first()
+        if used_storage is None:
+            return None # vault was deleted since it was flagged
+        # a new statement after the lock, so it sees every file committed before we got it
+        actual = session.scalar(select(func.coalesce(func.sum(File.size), 0)).where(File.vault_id == vault_id))
+        if actual == used_storage:
+            return None
+        session.execute(
+            update(Vault)
+            .where(Vault.id == vault_id)
+            .values(used_storage=actual, version=Vault.version + 1) # /vault/fetch returns used_storage, so clients must refetch
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+    return actual
+
+
+def recompute_used_storage(repair: bool = False) -> int:
+    """
+    Compares every vault's used_storage against the sum of its file sizes in a single query.
+    With repair, each drifted vault is then corrected on its own under a row lock. Returns the number of drifted vaults.
+    """
+    actual = (
+        select(func.coalesce(func.sum(File.size), 0))
+        .where(File.vault_id == Vault.id)
+        .scalar_subquery()
+    )
+    stmt = select(Vault.id, Vault.vault, Vault.used_storage, actual).where(Vault.used_storage != actual)
+    drifted = 0
+    with Session(engine) as session:
+        for vault_id, vault_name, used_storage, actual_storage in session.execute(stmt.execution_options(yield_per=500)):
+            drifted += 1
+            print(f"used_storage vault={vault_name!r} id={vault_id} is {used_storage}, files add up to {actual_storage}")
+            if repair:
+                repaired = repair_used_storage(vault_id)
+                if repaired is not None:
+                    print(f"used_storage vault={vault_name!r} id={vault_id} set to {repaired}")
+    return drifted
+
+
+def reconcile(repair: bool = False, page_size: int = 1000, grace_seconds: int = 3600) -> Dict[str, int]:
+    """
+    Streams the bucket listing and the files table side by side and reports every mismatch.
+    With repair, orphaned objects are deleted, rows without an object are deleted, file sizes
+    are taken from the object, and used_storage is recomputed afterwards.
+
+    Anything newer than grace_seconds is reported but never repaired, since an upload in
+    progress has its row committed before the object exists.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+    counts = {MISSING_OBJECT: 0, ORPHANED_OBJECT: 0, FOREIGN_OBJECT: 0, SIZE_MISMATCH: 0, "repaired": 0}
+    orphaned_keys: List[str] = []
+    missing_ids: List[UUID] = []
+
+    for obj, row in merge_join(iter_s3_objects(page_size), iter_file_rows(page_size)):
+        if row is None and not is_file_key(obj["Key"]):
+            counts[FOREIGN_OBJECT] += 1
+            print(f"{FOREIGN_OBJECT} key={obj['Key']!r}")
+        elif row is None:
+            counts[ORPHANED_OBJECT] += 1
+            print(f"{ORPHANED_OBJECT} key={obj['Key']} size={obj['Size']}")
+            if repair and obj["LastModified"] < cutoff:
+                orphaned_keys.append(obj["Key"])
+                if len(orphaned_keys) >= S3_DELETE_LIMIT:
+                    counts["repaired"] += delete_orphaned_objects(orphaned_keys)
+                    orphaned_keys = []
+        elif obj is None:
+            counts[MISSING_OBJECT] += 1
+            print(f"{MISSING_OBJECT} file={row.id} vault_id={row.vault_id} size={row.size}")
+            if repair and row.date_created < cutoff:
+                missing_ids.append(row.id)
+                if len(missing_ids) >= page_size:
+                    counts["repaired"] += delete_missing_rows(missing_ids, cutoff)
+                    missing_ids = []
+        elif obj["Size"] != row.size:
+            counts[SIZE_MISMATCH] += 1
+            print(f"{SIZE_MISMATCH} file={row.id} vault_id={row.vault_id} row_size={row.size} object_size={obj['Size']}")
+            if repair and obj["LastModified"] < cutoff:
+                if fix_file_size(row.id, row.vault_id, obj["Size"]):
+                    counts["repaired"] += 1
+
+    if repair:
+        counts["repaired"] += delete_orphaned_objects(orphaned_keys)
+        counts["repaired"] += delete_missing_rows(missing_ids, cutoff)
+
+    # run last, so rows removed above are no longer counted
+    counts["drifted_vaults"] = recompute_used_storage(repair=repair)
+    return counts
@@ -0,0 +1,32 @@
+import unittest
+
+from etag import etag_matches
+
+
+class EtagMatchesTest(unittest.TestCase):
+    etag = 'W/"1-owner-7"'
+
+    def test_missing_header(self):
+        self.assertFalse(etag_matches(None, self.etag))
+
+    def test_exact_weak_tag(self):
+        self.assertTrue(etag_matches('W/"1-owner-7"', self.etag))
+
+    def test_weak_comparison_ignores_prefix(self):
+        self.assertTrue(etag_matches('"1-owner-7"', self.etag))
+        self.assertTrue(etag_matches('W/"1-owner-7"', '"1-owner-7"'))
+
+    def test_list_of_tags(self):
+        self.assertTrue(etag_matches('W/"1-owner-6", W/"1-owner-7"', self.etag))
+        self.assertFalse(etag_matches('W/"1-owner-5",W/"1-owner-6"', self.etag))
+
+    def test_wildcard(self):
+        self.assertTrue(etag_matches("*", self.etag))
+
+    def test_other_version_or_role(self):
+        self.assertFalse(etag_matches('W/"1-owner-8"', self.etag))
+        self.assertFalse(etag_matches('W/"1-guest-7"', self.etag))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+from types import SimpleNamespace
+from uuid import UUID
+
+from reconcile.merge import merge_join, is_file_key
+
+# sorted the way Postgres sorts uuid columns, bytewise
+IDS = sorted(
+    [
+        UUID("0197f1b2-8c3e-7a10-9d2f-5b6c7d8e9f01"),
+        UUID("0197f1b2-8c3e-7a10-9d2f-5b6c7d8e9f02"),
+        UUID("0197f1b3-0000-7000-8000-000000000000"),
+        UUID("a197f1b2-8c3e-7a10-9d2f-5b6c7d8e9f01"),
+        UUID("f0000000-0000-7000-8000-000000000000"),
+    ],
+    key=lambda file_id: file_id.bytes,
+)
+
+
+def objects(*keys):
+    return iter([{"Key": key, "Size": 1} for key in keys])
+
+def rows(*file_ids):
+    return iter([SimpleNamespace(id=file_id) for file_id in file_ids])
+
+def pairs(objs, file_rows):
+    return [
+        (obj["Key"] if obj else None, row.id if row else None)
+        for obj, row in merge_join(objs, file_rows)
+    ]
+
+
+class MergeJoinTest(unittest.TestCase):
+    def test_uuid_byte_order_matches_key_order(self):
+        self.assertEqual([str(file_id) for file_id in IDS], sorted(str(file_id) for file_id in IDS))
+
+    def test_equal_streams(self):
+        result = pairs(objects(*map(str, IDS)), rows(*IDS))
+        self.assertEqual(result, [(str(file_id), file_id) for file_id in IDS])
+
+    def test_interleaved(self):
+        result = pairs(objects(str(IDS[0]), str(IDS[2]), str(IDS[3])), rows(IDS[1], IDS[2], IDS[4]))
+        self.assertEqual(result, [
+            (str(IDS[0]), None),
+            (None, IDS[1]),
+            (str(IDS[2]), IDS[2]),
+            (str(IDS[3]), None),
+            (None, IDS[4]),
+        ])
+
+    def test_only_objects(self):
+        result = pairs(objects(str(IDS[0]), str(IDS[1])), rows())
+        self.assertEqual(result, [(str(IDS[0]), None), (str(IDS[1]), None)])
+
+    def test_only_rows(self):
+        result = pairs(objects(), rows(IDS[0], IDS[1]))
+        self.assertEqual(result, [(None, IDS[0]), (None, IDS[1])])
+
+    def test_both_empty(self):
+        self.assertEqual(pairs(objects(), rows()), [])
+
+    def test_foreign_keys_do_not_pair_with_rows(self):
+        # S3 lists keys in byte order, so these land before, between and after the file ids
+        keys = sorted(["-backup", str(IDS[0]), "README.txt", "zz/notes"])
+        result = pairs(objects(*keys), rows(IDS[0], IDS[1]))
+        self.assertEqual(result, [
+            ("-backup", None),
+            (str(IDS[0]), IDS[0]),
+            (None, IDS[1]),
+            ("README.txt", None),
+            ("zz/notes", None),
+        ])
+
+
+class IsFileKeyTest(unittest.TestCase):
+    def test_canonical_uuid(self):
+        self.assertTrue(is_file_key(str(IDS[0])))
+
+    def test_uppercase_uuid_is_foreign(self):
+        self.assertFalse(is_file_key(str(IDS[0]).upper()))
+
+    def test_uuid_without_dashes_is_foreign(self):
+        self.assertFalse(is_file_key(IDS[0].hex))
+
+    def test_other_keys(self):
+        self.assertFalse(is_file_key("README.txt"))
+        self.assertFalse(is_file_key(""))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from types import SimpleNamespace
+from uuid import uuid4
+
+from vault_sync import apply_visibility, public_until, guest_changes
+
+
+def make_file(visibility="private", hidden_version=None, version=0):
+    return SimpleNamespace(id=uuid4(), visibility=visibility, hidden_version=hidden_version, version=version)
+
+
+class ApplyVisibilityTest(unittest.TestCase):
+    def test_public_to_private_sets_hidden_version(self):
+        file = make_file("public")
+        apply_visibility(file, "private", 5)
+        self.assertEqual(file.visibility, "private")
+        self.assertEqual(file.hidden_version, 5)
+
+    def test_private_to_private_keeps_hidden_version(self):
+        file = make_file("private", hidden_version=5)
+        apply_visibility(file, "private", 8)
+        self.assertEqual(file.hidden_version, 5)
+
+    def test_never_public_stays_unset(self):
+        file = make_file("private")
+        apply_visibility(file, "private", 3)
+        self.assertIsNone(file.hidden_version)
+
+    def test_to_public_clears_hidden_version(self):
+        file = make_file("private", hidden_version=5)
+        apply_visibility(file, "public", 9)
+        self.assertEqual(file.visibility, "public")
+        self.assertIsNone(file.hidden_version)
+
+
+class PublicUntilTest(unittest.TestCase):
+    def test_public_file_is_visible_until_deleted(self):
+        self.assertEqual(public_until("public", None, 7), 7)
+
+    def test_file_hidden_earlier_is_visible_until_hidden(self):
+        self.assertEqual(public_until("private", 4, 7), 4)
+
+    def test_never_public_file(self):
+        self.assertIsNone(public_until("private", None, 7))
+
+
+class GuestChangesTest(unittest.TestCase):
+    def setUp(self):
+        self.public = make_file("public", version=6)
+        self.hidden_after_cursor = make_file("private", hidden_version=6, version=6)
+        self.hidden_before_cursor = make_file("private", hidden_version=2, version=6) # renamed after being hidden
+        self.never_public = make_file("private", version=6)
+        self.changed = [self.public, self.hidden_after_cursor, self.hidden_before_cursor, self.never_public]
+
+    def test_guest_gets_only_public_files(self):
+        files, _ = guest_changes(self.changed, 4)
+        self.assertEqual(files, [self.public])
+
+    def test_guest_drops_only_files_hidden_since_cursor(self):
+        _, hidden = guest_changes(self.changed, 4)
+        self.assertEqual(hidden, [self.hidden_after_cursor.id])
+
+    def test_hidden_at_cursor_was_already_reported(self):
+        _, hidden = guest_changes(self.changed, 6)
+        self.assertEqual(hidden, [])
+
+    def test_full_sync_drops_nothing(self):
+        files, hidden = guest_changes(self.changed, 0)
+        self.assertEqual(files, [self.public])
+        self.assertEqual(hidden, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
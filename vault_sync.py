@@ -0,0 +1,31 @@
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+# Rules deciding what guests see in /vault/changes. Kept free of database imports so they can be unit tested.
+
+
+def apply_visibility(file, visibility: str, version: int) -> None:
+    """Sets visibility on a file, recording the vault version at which a public file was made private."""
+    if file.visibility == "public" and visibility != "public":
+        file.hidden_version = version
+    elif visibility == "public":
+        file.hidden_version = None
+    file.visibility = visibility
+
+def public_until(visibility: str, hidden_version: Optional[int], version: int) -> Optional[int]:
+    """Last vault version guests could see a file deleted at `version`, None if it was never public."""
+    return version if visibility == "public" else hidden_version
+
+def guest_changes(changed_files: list, cursor: int) -> Tuple[list, List[UUID]]:
+    """
+    Splits changed files into the ones a guest gets and the ids a guest must drop,
+    which are only files that were public after the guest's cursor.
+    """
+    files = [file for file in changed_files if file.visibility == "public"]
+    if cursor == 0:
+        return files, [] # full sync, nothing to drop
+    hidden = [
+        file.id for file in changed_files
+        if file.visibility != "public" and file.hidden_version is not None and file.hidden_version > cursor
+    ]
+    return files, hidden